@@ -2,26 +2,34 @@
 """ECMWF scraper"""
 
 import logging
-from calendar import monthrange
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from functools import lru_cache
 from os.path import basename, exists, join
-from typing import Dict, Optional
-from zipfile import ZipFile
+from threading import Lock, local
+from typing import Dict, List, Optional, Tuple
+from zipfile import ZIP_STORED, ZipFile
 
 import numpy as np
 import pandas as pd
+
+# registers the .rio accessor, which the grid template needs before any GRIB
+# file has been opened
+import rioxarray  # noqa: F401
 import xarray as xr
 from cdsapi import Client
 from dateutil.relativedelta import relativedelta
 from exactextract import exact_extract
+from exactextract.feature import JSONFeatureSource
+from exactextract.raster import XArrayRasterSource
 from geopandas import read_file
 from hdx.api.configuration import Configuration
 from hdx.data.dataset import Dataset
 from hdx.data.resource import Resource
 from hdx.location.country import Country
-from hdx.utilities.dateparse import iso_string_from_datetime, parse_date
+from hdx.utilities.dateparse import iso_string_from_datetime
 from hdx.utilities.retriever import Retrieve
-from rasterio import open
 from requests.exceptions import HTTPError
 
 logger = logging.getLogger(__name__)
@@ -33,10 +41,15 @@ class Pipeline:
         self._retriever = retriever
         self._tempdir = tempdir
         self.global_boundaries = {}
+        self._boundary_features = {}
+        self._boundary_coverage = {}
         self.grib_data = []
         self.existing_dates = []
         self.processed_data = {}
         self.raster_data = []
+        self._processed_rows = defaultdict(list)
+        self._grib_lock = Lock()
+        self._thread_data = local()
 
     def download_global_boundaries(self) -> None:
         dataset_info = self._configuration["global_boundaries"]
@@ -46,27 +59,47 @@ class Pipeline:
         ]
         resource = resource[0]
         zip_file_path = self._retriever.download_file(resource["url"])
-        gdb_file_path = join(self._tempdir, "global_boundaries")
-        with ZipFile(zip_file_path, "r") as z:
-            z.extractall(gdb_file_path)
-        gdb_file = join(gdb_file_path, "global_admin_boundaries_matched_latest.gdb")
-        for admin_level in ["0", "1"]:
-            adm_data = read_file(gdb_file, layer=f"admin{admin_level}")
+        # GDAL reads the geodatabase straight out of the archive, inflating
+        # only the layers that are read instead of extracting everything
+        gdb_file = f"/vsizip/{zip_file_path}/global_admin_boundaries_matched_latest.gdb"
+        read_columns = {
+            "0": ["iso3", "adm0_name"],
+            "1": ["iso3", "adm0_name", "adm1_name", "adm1_pcode"],
+        }
+        grid = _get_seas5_grid()
+        for admin_level, columns in read_columns.items():
+            # only parse the attributes that are used, with the vectorised
+            # pyogrio reader
+            adm_data = read_file(
+                gdb_file,
+                layer=f"admin{admin_level}",
+                columns=columns,
+                engine="pyogrio",
+            )
             # adm_data = adm_data.to_crs(epsg=4326)
             adm_data.rename(columns={"iso3": "iso_code"}, inplace=True)
-            keep_columns = [
-                "iso_code",
-                "adm0_name",
-                "adm1_name",
-                "adm1_pcode",
-                "geometry",
-            ]
-            drop_columns = [c for c in adm_data.columns if c not in keep_columns]
-            adm_data.drop(drop_columns, axis=1, inplace=True)
             adm_data["geometry"] = adm_data["geometry"].simplify(
                 tolerance=0.001, preserve_topology=True
             )
+            if admin_level == "1":
+                # the boundaries are fixed for the run so look up each admin 1
+                # unit's region once here rather than for every issue date
+                adm_data["region"] = adm_data["iso_code"].map(_get_region_info())
+                # every admin 1 unit must be published in a regional file
+                unmapped = adm_data.loc[adm_data["region"].isna(), "iso_code"]
+                if len(unmapped) > 0:
+                    unmapped = ", ".join(sorted(unmapped.astype(str).unique()))
+                    raise KeyError(f"No region found for ISO3 codes: {unmapped}")
             self.global_boundaries[admin_level] = adm_data
+            self._boundary_features[admin_level] = JSONFeatureSource(
+                list(adm_data.iterfeatures()), srs_wkt=adm_data.crs.to_wkt()
+            )
+            # the boundaries and the SEAS5 grid are both fixed for the run, so
+            # the cells each polygon covers (and by how much) are worked out
+            # once here rather than for every raster
+            self._boundary_coverage[admin_level] = _get_coverage(
+                grid, self._boundary_features[admin_level]
+            )
         return
 
     def download_cds_data(
@@ -77,153 +110,229 @@ class Pipeline:
             root_dir = self._retriever.saved_dir
         else:
             root_dir = self._tempdir
-        client = Client(url=self._configuration["cds_url"], key=cds_key)
         dataset = "seasonal-postprocessed-single-levels"
         variable = "total_precipitation_anomalous_rate_of_accumulation"
 
+        # create list of missing data that needs to be added
+        existing_dates = set(self.existing_dates)
+        year_requests = []
         for year in range(self._configuration["min_year"], today.year + 1):
-            # create list of missing data that needs to be added
             months = []
             end_month = 12 if year != today.year else today.month
             for month in range(1, end_month + 1):
                 data_date = f"{year}-{str(month).zfill(2)}"
-                if data_date not in self.existing_dates:
+                if data_date not in existing_dates:
                     months.append(str(month))
             if len(months) == 0:
                 continue
-
             file_name = f"{variable}_{year}.grib"
             filepath = join(root_dir, file_name)
-            request = {
-                "originating_centre": "ecmwf",
-                "system": "51",
-                "variable": ["total_precipitation_anomalous_rate_of_accumulation"],
-                "product_type": ["ensemble_mean"],
-                "year": str(year),
-                "month": months,
-                "leadtime_month": ["1", "2", "3", "4", "5", "6"],
-                "data_format": "grib",
-            }
-            success = self.download_grib(client, request, dataset, filepath)
-            if year == today.year and not success:
-                logger.info("Download failed, trying without current month")
-                request = {
-                    "originating_centre": "ecmwf",
-                    "system": "51",
-                    "variable": ["total_precipitation_anomalous_rate_of_accumulation"],
-                    "product_type": ["ensemble_mean"],
-                    "year": str(year),
-                    "month": months[:-1],
-                    "leadtime_month": ["1", "2", "3", "4", "5", "6"],
-                    "data_format": "grib",
-                }
-                _ = self.download_grib(client, request, dataset, filepath)
+            year_requests.append((year, months, filepath))
+        # everything up to today has already been published
+        if not year_requests:
+            return False
+
+        # CDS requests spend most of their time queued server side so submit
+        # them together, capping the number of workers to respect fair use
+        with ThreadPoolExecutor(
+            max_workers=self._configuration["cds_max_workers"]
+        ) as executor:
+            futures = [
+                executor.submit(
+                    self._request_year,
+                    cds_key,
+                    dataset,
+                    year,
+                    months,
+                    filepath,
+                    year == today.year,
+                )
+                for year, months, filepath in year_requests
+            ]
+            for future in as_completed(futures):
+                filepath, success = future.result()
+                if not success:
+                    logger.warning(f"Download of {basename(filepath)} failed")
+        self.grib_data.sort()
 
         if len(self.grib_data) > 0:
             return True
         return False
 
     def download_grib(
-        self, client: Client, request: dict, dataset: str, filepath: str
+        self, cds_key: str, request: dict, dataset: str, filepath: str
     ) -> bool:
         if exists(filepath):
-            self.grib_data.append(filepath)
+            self._add_grib(filepath)
             return True
         try:
-            client.retrieve(dataset, request, filepath)
-            self.grib_data.append(filepath)
+            self._get_client(cds_key).retrieve(dataset, request, filepath)
+            self._add_grib(filepath)
         except HTTPError:
             return False
         return True
 
     def process(self, today: datetime) -> None:
-        regions = _get_region_info()
-        for grib_data in self.grib_data:
-            dataset = xr.open_mfdataset(
-                grib_data,
-                engine="cfgrib",
-                drop_variables=["surface", "values"],
-                backend_kwargs={"time_dims": ("forecastMonth", "time")},
+        # open all years as a single lazy dataset rather than reopening and
+        # reindexing each file in turn
+        grib_dataset = xr.open_mfdataset(
+            self.grib_data,
+            engine="cfgrib",
+            combine="nested",
+            concat_dim="time",
+            # one chunk per GRIB message, which holds one issue date and leadtime
+            chunks={"time": 1, "forecastMonth": 1},
+            drop_variables=["surface", "values"],
+            backend_kwargs={
+                "time_dims": ("forecastMonth", "time"),
+                # all files share the SEAS5 grid so coordinates only need
+                # to be built once
+                "cache_geo_coords": True,
+                # each file is only opened once per run, so don't write a
+                # cfgrib index file next to the downloaded GRIB files
+                "indexpath": "",
+            },
+        )
+        dataset = _recentre_longitude(grib_dataset)
+        issue_dates = dataset.time.values
+        latest_issue_date = issue_dates.max()
+        variable = next(iter(dataset.data_vars))
+        leadtime_months = dataset.forecastMonth.values
+
+        # convert to accumulation for every issue date and leadtime at once.
+        # SEAS5 is issued on the first of the month so the valid months are
+        # plain month arithmetic on the (issue date, leadtime) grid
+        valid_times = issue_dates.astype("datetime64[M]")[:, np.newaxis] + (
+            leadtime_months - 1
+        ).astype("timedelta64[M]")
+        valid_days = valid_times.astype("datetime64[D]")
+        numdays = xr.DataArray(
+            ((valid_times + 1).astype("datetime64[D]") - valid_days).astype(int),
+            coords={"time": issue_dates, "forecastMonth": leadtime_months},
+            dims=("time", "forecastMonth"),
+        ).astype(np.float32)
+        # numdays is float32 and the constants are python ints, so the cube
+        # stays float32 throughout rather than being promoted to float64
+        dataset = dataset * numdays * 24 * 60 * 60 * 1000
+        # the cube is small (a few MB per year) so compute it into memory once
+        # rather than re-running the decode, sort and scale for every slice
+        dataset = dataset.load()
+        dataset = dataset.rio.write_crs("EPSG:4326")
+
+        past_3yrs = today - relativedelta(years=3)
+        valid_year, valid_month = np.divmod(valid_times.astype(int), 12)
+        valid_year += 1970
+        valid_month += 1
+        recent = valid_days >= np.datetime64(past_3yrs.date())
+        include_cols = {
+            "0": ["iso_code", "adm0_name"],
+            "1": ["iso_code", "adm0_name", "adm1_pcode", "adm1_name"],
+        }
+        stat_columns = {
+            "count": "pixel_count",
+            "mean": "mean_anomaly",
+            "median": "median_anomaly",
+        }
+        # only the latest rasters are published so only they need to be saved
+        # to disk
+        year = np.datetime_as_string(latest_issue_date, unit="Y")
+        month = np.datetime_as_string(latest_issue_date, unit="M")[-2:]
+        for leadtime_month in leadtime_months:
+            data = dataset.sel(time=latest_issue_date, forecastMonth=leadtime_month)
+            raster_name = f"anomalous_accumulation_{year}_{month}_leadtime{int(leadtime_month) - 1}.tif"
+            out_tif = join(self._tempdir, raster_name)
+            # the slice is already in memory so write it in one go without
+            # dask locking
+            data.rio.to_raster(
+                out_tif,
+                dtype="float32",
+                # tiled DEFLATE gives the smallest files for these anomalies;
+                # a floating point predictor makes them larger
+                compress="DEFLATE",
+                tiled=True,
+                blockxsize=256,
+                blockysize=256,
+                # compress the tiles in parallel
+                num_threads="ALL_CPUS",
+                lock=False,
+                windowed=False,
+            )
+            self.raster_data.append((year, month, out_tif))
+
+        # zeros rather than data so that no cell is skipped as nodata
+        grid = xr.zeros_like(dataset[variable].isel(time=0, forecastMonth=0))
+        if not _same_grid(grid, _get_seas5_grid()):
+            logger.warning(
+                "GRIB grid differs from SEAS5, recomputing boundary coverage"
             )
-            dataset = dataset.assign_coords(
-                longitude=(((dataset.longitude + 180) % 360) - 180)
-            ).sortby("longitude")
-            dataset = dataset.rio.write_crs("EPSG:4326")
-            issue_dates = dataset.time.values
-            if not isinstance(issue_dates, np.ndarray):
-                issue_dates = np.asarray([issue_dates])
-            leadtime_months = dataset.forecastMonth.values
-            for issue_date in issue_dates:
-                logger.info(f"Processing issue date: {issue_date}")
-                year = np.datetime_as_string(issue_date, unit="Y")
-                month = np.datetime_as_string(issue_date, unit="M")[-2:]
-                for leadtime_month in leadtime_months:
-                    logger.info(f"Processing leadtime month: {leadtime_month}")
-
-                    # convert to accumulation
-                    valid_time = pd.to_datetime(issue_date) + relativedelta(
-                        months=leadtime_month - 1
+            for admin_level, features in self._boundary_features.items():
+                self._boundary_coverage[admin_level] = _get_coverage(grid, features)
+        boundaries = {
+            admin_level: (
+                self.global_boundaries[admin_level][columns],
+                *self._boundary_coverage[admin_level],
+            )
+            for admin_level, columns in include_cols.items()
+        }
+
+        lead_times = [int(leadtime_month) - 1 for leadtime_month in leadtime_months]
+        dims = ("forecastMonth", dataset.rio.y_dim, dataset.rio.x_dim)
+        # every issue date gives one admin 1 row per polygon and lead time in
+        # the same order, so the rows belonging to each region are fixed
+        regions = np.repeat(self.global_boundaries["1"]["region"], len(lead_times))
+        region_rows = pd.DataFrame({"region": regions.to_numpy()})
+        region_rows = region_rows.groupby("region", sort=False).indices
+        for i, issue_date in enumerate(issue_dates):
+            logger.info(f"Processing issue date: {issue_date}")
+            year = np.datetime_as_string(issue_date, unit="Y")
+            month = np.datetime_as_string(issue_date, unit="M")[-2:]
+            valid_years = dict(zip(lead_times, valid_year[i]))
+            valid_months = dict(zip(lead_times, valid_month[i]))
+            in_past_3yrs = dict(zip(lead_times, recent[i]))
+
+            # calculate statistics
+            data = dataset[variable].sel(time=issue_date).transpose(*dims).values
+            results_by_level = _extract_statistics(data, boundaries, lead_times)
+            for admin_level, results in results_by_level.items():
+                # reshape the "<lead time>_<stat>" columns into one row per
+                # polygon and lead time in a single step
+                results = results.set_index(include_cols[admin_level])
+                results.columns = results.columns.str.split("_", n=1, expand=True)
+                results_zs = results.stack(level=0, future_stack=True)
+                results_zs.index.names = include_cols[admin_level] + ["lead_time"]
+                results_zs = results_zs.reset_index()
+                results_zs["lead_time"] = results_zs["lead_time"].astype(int)
+                results_zs = results_zs.rename(columns=stat_columns)
+                results_zs[list(stat_columns.values())] = results_zs[
+                    list(stat_columns.values())
+                ].round(5)
+
+                # add needed fields
+                results_zs["admin_level"] = admin_level
+                results_zs["issue_year"] = int(year)
+                results_zs["issue_month"] = int(month)
+                results_zs["valid_year"] = results_zs["lead_time"].map(valid_years)
+                results_zs["valid_month"] = results_zs["lead_time"].map(valid_months)
+
+                # add to processed data dataframes
+                if admin_level == "0":
+                    identifier = "adm0"
+                    self._add_processed_rows(identifier, results_zs)
+                    continue
+                # only add rows when a leadtime falls in the last 3 years, so
+                # that no empty output is created
+                if recent[i].any():
+                    identifier = "adm1_global_3yrs"
+                    self._add_processed_rows(
+                        identifier,
+                        results_zs[results_zs["lead_time"].map(in_past_3yrs)],
                     )
-                    numdays = monthrange(valid_time.year, valid_time.month)[1]
-                    data = dataset.sel(time=issue_date, forecastMonth=leadtime_month)
-                    data = data * numdays * 24 * 60 * 60 * 1000
-
-                    # save to raster
-                    raster_name = f"anomalous_accumulation_{year}_{month}_leadtime{int(leadtime_month) - 1}.tif"
-                    out_tif = join(self._tempdir, raster_name)
-                    data.rio.to_raster(out_tif)
-                    self.raster_data.append(out_tif)
-
-                    # calculate statistics
-                    with open(out_tif) as open_raster:
-                        for admin_level in ["0", "1"]:
-                            adm_data = self.global_boundaries[admin_level]
-                            include_cols = ["iso_code", "adm0_name"]
-                            if admin_level == "1":
-                                include_cols += ["adm1_pcode", "adm1_name"]
-                            iso_list = list(set(adm_data["iso_code"]))
-                            for iso in iso_list:
-                                subset_adm_data = adm_data[adm_data["iso_code"] == iso]
-                                results_zs = exact_extract(
-                                    open_raster,
-                                    subset_adm_data,
-                                    ["count", "mean", "median"],
-                                    include_cols=include_cols,
-                                    output="pandas",
-                                )
-                                results_zs[["count", "mean", "median"]] = results_zs[
-                                    ["count", "mean", "median"]
-                                ].round(5)
-                                results_zs.rename(
-                                    columns={
-                                        "count": "pixel_count",
-                                        "mean": "mean_anomaly",
-                                        "median": "median_anomaly",
-                                    },
-                                    inplace=True,
-                                )
-
-                                # add needed fields
-                                results_zs["admin_level"] = admin_level
-                                results_zs["issue_year"] = int(year)
-                                results_zs["issue_month"] = int(month)
-                                results_zs["lead_time"] = int(leadtime_month) - 1
-                                results_zs["valid_year"] = int(valid_time.year)
-                                results_zs["valid_month"] = int(valid_time.month)
-
-                                # add to processed data dataframes
-                                if admin_level == "0":
-                                    identifier = "adm0"
-                                    self._add_processed_rows(identifier, results_zs)
-                                else:
-                                    past_3yrs = today - relativedelta(years=3)
-                                    if valid_time.date() >= past_3yrs.date():
-                                        identifier = "adm1_global_3yrs"
-                                        self._add_processed_rows(identifier, results_zs)
-                                    region_name = regions[iso]
-                                    identifier = f"adm1_{region_name.lower()}"
-                                    self._add_processed_rows(identifier, results_zs)
+                for region_name, rows in region_rows.items():
+                    identifier = f"adm1_{region_name.lower()}"
+                    self._add_processed_rows(identifier, results_zs.iloc[rows])
 
+        grib_dataset.close()
+        self._concat_processed_rows()
         return
 
     def generate_dataset(self) -> Optional[Dataset]:
@@ -236,15 +345,12 @@ class Pipeline:
             }
         )
 
-        dates = [
-            str(y) + "-" + str(m).zfill(2)
-            for y, m in zip(
-                self.processed_data["adm0"]["issue_year"],
-                self.processed_data["adm0"]["issue_month"],
-            )
-        ]
-        start_date = parse_date(f"{min(dates)}-01")
-        end_date = parse_date(f"{max(dates)}-01")
+        # months since year 0, so the range needs no per-row string formatting
+        adm0_data = self.processed_data["adm0"]
+        months = adm0_data["issue_year"] * 12 + adm0_data["issue_month"] - 1
+        start, end = divmod(months.min(), 12), divmod(months.max(), 12)
+        start_date = datetime(start[0], start[1] + 1, 1, tzinfo=timezone.utc)
+        end_date = datetime(end[0], end[1] + 1, 1, tzinfo=timezone.utc)
         end_date = end_date + relativedelta(day=31)
         dataset.set_time_period(startdate=start_date, enddate=end_date)
 
@@ -281,27 +387,38 @@ class Pipeline:
             }
             if admin_level == "1":
                 resourcedata["p_coded"] = True
-            dataset.generate_resource(
-                folder=self._tempdir,
-                filename=filename,
-                rows=processed_data.to_dict(orient="records"),
-                resourcedata=resourcedata,
-                headers=list(processed_data.columns),
+            if len(processed_data) == 0:
+                logger.error(f"No data rows in {filename}!")
+                continue
+            # write directly from pandas rather than building a dict per row,
+            # writing missing values as "nan" as generate_resource did
+            file_path = join(self._tempdir, filename)
+            processed_data.to_csv(
+                file_path,
+                index=False,
                 encoding="utf-8-sig",
+                lineterminator="\r\n",
+                na_rep="nan",
             )
+            resource = Resource(resourcedata)
+            resource.set_format("csv")
+            resource.set_file_to_upload(file_path)
+            dataset.add_update_resource(resource)
 
         # Add zipped raster resource
-        raster_dates = [
-            "_".join(basename(raster).split("_")[2:4]) for raster in self.raster_data
-        ]
-        latest_date = max(raster_dates)
+        # rasters are recorded with their issue year and month
+        latest = max(self.raster_data)[:2]
+        latest_date = "_".join(latest)
         raster_paths = [
-            raster for raster in self.raster_data if latest_date in basename(raster)
+            raster
+            for year, month, raster in self.raster_data
+            if (year, month) == latest
         ]
         latest_zip = join(
             self._tempdir, f"forecast_precipitation_anomalies_geotiff_{latest_date}.zip"
         )
-        with ZipFile(latest_zip, "w") as z:
+        # the GeoTIFFs are already compressed so store them without recompressing
+        with ZipFile(latest_zip, "w", compression=ZIP_STORED) as z:
             for raster_path in raster_paths:
                 z.write(raster_path, basename(raster_path))
         resource = Resource(
@@ -316,6 +433,36 @@ class Pipeline:
 
         return dataset
 
+    def _request_year(
+        self,
+        cds_key: str,
+        dataset: str,
+        year: int,
+        months: List[str],
+        filepath: str,
+        current_year: bool,
+    ) -> Tuple[str, bool]:
+        request = _build_request(year, months)
+        success = self.download_grib(cds_key, request, dataset, filepath)
+        # nothing is left to request if only the current month was missing
+        if current_year and not success and len(months) > 1:
+            logger.info("Download failed, trying without current month")
+            request = _build_request(year, months[:-1])
+            success = self.download_grib(cds_key, request, dataset, filepath)
+        return filepath, success
+
+    def _get_client(self, cds_key: str) -> Client:
+        # cdsapi clients are not thread safe so each worker gets its own
+        client = getattr(self._thread_data, "client", None)
+        if client is None:
+            client = Client(url=self._configuration["cds_url"], key=cds_key)
+            self._thread_data.client = client
+        return client
+
+    def _add_grib(self, filepath: str) -> None:
+        with self._grib_lock:
+            self.grib_data.append(filepath)
+
     def _get_uploaded_data(self, today: datetime, force_refresh: bool) -> None:
         if force_refresh:
             return
@@ -329,35 +476,227 @@ class Pipeline:
             file_path = self._retriever.download_file(resource["url"])
             identifier = "_".join(resource["name"][:-4].split("_")[3:])
             uploaded_data = pd.read_csv(file_path)
-            dates = [
-                str(y) + "-" + str(m).zfill(2)
-                for y, m in zip(
-                    uploaded_data["issue_year"], uploaded_data["issue_month"]
-                )
-            ]
+            dates = _get_issue_dates(uploaded_data)
             # filter data to only include past 3 years
             if "3yrs" in resource["name"]:
                 past_3yrs = today - relativedelta(years=3)
                 past_3yrs = f"{past_3yrs.year}-{past_3yrs.month}"
-                uploaded_data = uploaded_data[[d > past_3yrs for d in dates]]
+                uploaded_data = uploaded_data[dates > past_3yrs]
             self.processed_data[identifier] = uploaded_data
 
-            dates = list(set(dates + self.existing_dates))
+            dates = set(dates.unique()).union(self.existing_dates)
             self.existing_dates = sorted(dates)
 
-    def _add_processed_rows(self, identifier: str, df: pd.DataFrame()) -> None:
-        if self.processed_data.get(identifier) is None:
-            self.processed_data[identifier] = df
-        else:
-            self.processed_data[identifier] = pd.concat(
-                [
-                    self.processed_data[identifier],
-                    df,
-                ],
-                ignore_index=True,
+    def _add_processed_rows(self, identifier: str, df: pd.DataFrame) -> None:
+        # concatenating on every call copies everything accumulated so far,
+        # so buffer the rows and concatenate once at the end of processing
+        self._processed_rows[identifier].append(df)
+
+    def _concat_processed_rows(self) -> None:
+        for identifier, dfs in self._processed_rows.items():
+            if self.processed_data.get(identifier) is not None:
+                dfs = [self.processed_data[identifier]] + dfs
+            self.processed_data[identifier] = pd.concat(dfs, ignore_index=True)
+        self._processed_rows.clear()
+
+
+def _build_request(year: int, months: List[str]) -> Dict:
+    return {
+        "originating_centre": "ecmwf",
+        "system": "51",
+        "variable": ["total_precipitation_anomalous_rate_of_accumulation"],
+        "product_type": ["ensemble_mean"],
+        "year": str(year),
+        "month": months,
+        "leadtime_month": ["1", "2", "3", "4", "5", "6"],
+        "data_format": "grib",
+    }
+
+
+def _get_coverage(
+    grid: xr.DataArray, features: JSONFeatureSource
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # flattened grid cell ids, coverage fractions and feature index of every
+    # cell each feature touches, in the order exactextract visits them. The
+    # global grid and feature counts fit in int32, halving the index arrays
+    coverage = exact_extract(
+        XArrayRasterSource(grid),
+        features,
+        ["cell_id", "coverage"],
+        output="pandas",
+    )
+    cell_ids = coverage["cell_id"].to_list()
+    return (
+        np.concatenate(cell_ids).astype(np.int32),
+        np.concatenate(coverage["coverage"].to_list()),
+        np.repeat(
+            np.arange(len(cell_ids), dtype=np.int32), [len(ids) for ids in cell_ids]
+        ),
+    )
+
+
+def _get_seas5_grid() -> xr.DataArray:
+    # the global 1 degree grid of the SEAS5 post-processed products, with
+    # longitudes recentred to -180 to 180 as in process()
+    grid = xr.DataArray(
+        np.zeros((180, 360), dtype=np.float32),
+        coords={
+            "latitude": np.arange(89.5, -90, -1),
+            "longitude": np.arange(-179.5, 180, 1),
+        },
+        dims=("latitude", "longitude"),
+    )
+    return grid.rio.write_crs("EPSG:4326")
+
+
+def _same_grid(grid: xr.DataArray, other: xr.DataArray) -> bool:
+    return all(
+        np.array_equal(grid[dim].values, other[dim].values)
+        for dim in ("latitude", "longitude")
+    )
+
+
+def _recentre_longitude(dataset: xr.Dataset) -> xr.Dataset:
+    # SEAS5 longitudes run from 0 to 360, so moving them to -180 to 180 only
+    # rotates the grid. Rolling avoids sorting every cell of the cube
+    wrapped = ((dataset.longitude.values + 180) % 360) - 180
+    shift = -int(np.argmin(wrapped))
+    longitude = np.roll(wrapped, shift)
+    attrs = dataset.longitude.attrs
+    if np.any(np.diff(longitude) <= 0):
+        dataset = dataset.assign_coords(longitude=("longitude", wrapped, attrs))
+        return dataset.sortby("longitude")
+    dataset = dataset.roll(longitude=shift)
+    return dataset.assign_coords(longitude=("longitude", longitude, attrs))
+
+
+def _extract_statistics(
+    data: np.ndarray,
+    boundaries: Dict[str, Tuple[pd.DataFrame, np.ndarray, np.ndarray, np.ndarray]],
+    lead_times: List[int],
+) -> Dict[str, pd.DataFrame]:
+    # data is the (leadtime, lat, lon) stack for one issue date. Results have
+    # a "<lead time>_<stat>" column per leadtime and statistic, as
+    # exact_extract names them
+    results = {}
+    for admin_level, coverage_info in boundaries.items():
+        attributes, cells, coverage, feature_ids = coverage_info
+        columns = {}
+        for j, lead_time in enumerate(lead_times):
+            statistics = _zonal_statistics(
+                data[j], cells, coverage, feature_ids, len(attributes)
             )
+            for stat, values in statistics.items():
+                columns[f"{lead_time}_{stat}"] = values
+        results[admin_level] = attributes.assign(**columns)
+    return results
+
+
+def _zonal_statistics(
+    values: np.ndarray,
+    cells: np.ndarray,
+    coverage: np.ndarray,
+    feature_ids: np.ndarray,
+    n_features: int,
+) -> Dict[str, np.ndarray]:
+    # coverage weighted count, mean and median per feature, reproducing
+    # exactextract's arithmetic so the published figures do not change.
+    # bincount accumulates in input order, as exactextract does. Values stay
+    # float32 until they are weighted; NaN is the nodata value
+    cell_values = values.ravel()[cells]
+    valid = ~np.isnan(cell_values)
+    count = np.bincount(
+        feature_ids, weights=np.where(valid, coverage, 0), minlength=n_features
+    )
+    total = np.bincount(
+        feature_ids,
+        weights=np.where(valid, cell_values * coverage, 0),
+        minlength=n_features,
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(count > 0, total / count, np.nan)
+    median = _weighted_medians(
+        cell_values[valid], coverage[valid], feature_ids[valid], n_features
+    )
+    # exactextract returns quantiles at the raster's float32 precision
+    median = median.astype(np.float32).astype(np.float64)
+    return {"count": count, "mean": mean, "median": median}
+
+
+def _weighted_medians(
+    values: np.ndarray,
+    weights: np.ndarray,
+    feature_ids: np.ndarray,
+    n_features: int,
+) -> np.ndarray:
+    # exactextract merges identical values, then interpolates between the
+    # weighted positions of the distinct values either side of the midpoint.
+    # This does that for every feature at once. The sort is stable so
+    # identical values are summed in cell order
+    order = np.lexsort((values, feature_ids))
+    values = values[order]
+    weights = weights[order]
+    feature_ids = feature_ids[order]
+    first = np.ones(len(values), dtype=bool)
+    first[1:] = (feature_ids[1:] != feature_ids[:-1]) | (values[1:] != values[:-1])
+    weights = np.bincount(np.cumsum(first) - 1, weights=weights)
+    values = values[first].astype(np.float64)
+    feature_ids = feature_ids[first]
+    counts = np.bincount(feature_ids, minlength=n_features)
+    starts = np.cumsum(counts) - counts
+
+    # running sum of the weights within each feature. Adding one rank at a
+    # time across all features keeps each sum sequential like exactextract's
+    cumsum = weights.copy()
+    by_size = np.argsort(-counts, kind="stable")
+    sorted_counts = -counts[by_size]
+    sorted_starts = starts[by_size]
+    for rank in range(1, counts.max(initial=0)):
+        active = np.searchsorted(sorted_counts, -rank)
+        indices = sorted_starts[:active] + rank
+        cumsum[indices] += cumsum[indices - 1]
+
+    ranks = np.arange(len(values)) - starts[feature_ids]
+    positions = np.zeros(len(values))
+    later = np.flatnonzero(ranks > 0)
+    positions[later] = (
+        ranks[later] * weights[later]
+        + (counts[feature_ids[later]] - 1) * cumsum[later - 1]
+    )
+
+    medians = np.full(n_features, np.nan)
+    has_values = counts > 0
+    if not has_values.any():
+        return medians
+    starts = starts[has_values]
+    counts = counts[has_values]
+    ends = starts + counts - 1
+    target = 0.5 * cumsum[ends] * (counts - 1)
+    right = np.add.reduceat(positions < np.repeat(target, counts), starts)
+    lower = starts + np.clip(right - 1, 0, counts - 1)
+    upper = starts + np.clip(right, 0, counts - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        interpolated = values[lower] + (target - positions[lower]) * (
+            values[upper] - values[lower]
+        ) / (positions[upper] - positions[lower])
+    medians[has_values] = np.where(
+        right == 0,
+        values[starts],
+        np.where(right == counts, values[ends], interpolated),
+    )
+    return medians
+
+
+def _get_issue_dates(data: pd.DataFrame) -> pd.Series:
+    # build the YYYY-MM issue dates column-wise rather than row by row
+    return (
+        data["issue_year"].astype(str)
+        + "-"
+        + data["issue_month"].astype(str).str.zfill(2)
+    )
 
 
+@lru_cache(maxsize=1)
 def _get_region_info() -> Dict[str, str]:
     region_info = {}
     country_info = Country.countriesdata()["countries"]
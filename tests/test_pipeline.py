@@ -1,12 +1,26 @@
 from datetime import datetime
 from os.path import join
 
+import numpy as np
+import pytest
+import rioxarray  # noqa: F401
+import xarray as xr
+from exactextract import exact_extract
+from exactextract.feature import JSONFeatureSource
+from exactextract.raster import XArrayRasterSource
+from geopandas import GeoDataFrame
 from hdx.utilities.compare import assert_files_same
 from hdx.utilities.downloader import Download
 from hdx.utilities.path import temp_dir
 from hdx.utilities.retriever import Retrieve
+from shapely.geometry import Polygon, box
 
-from hdx.scraper.ecmwf.pipeline import Pipeline
+from hdx.scraper.ecmwf.pipeline import (
+    Pipeline,
+    _get_coverage,
+    _recentre_longitude,
+    _zonal_statistics,
+)
 
 
 class TestPipeline:
@@ -129,3 +143,199 @@ class TestPipeline:
                     ),
                     join(tempdir, "forecast_precipitation_anomalies_adm1_asia.csv"),
                 )
+
+    @staticmethod
+    def read_boundaries(iso_codes):
+        # one admin 1 unit per ISO3 code in place of the global boundaries
+        # geodatabase
+        def read_file(filename, layer, columns, engine):
+            boundaries = GeoDataFrame(
+                {
+                    "iso3": iso_codes,
+                    "adm0_name": iso_codes,
+                    "adm1_name": [f"{iso_code} 1" for iso_code in iso_codes],
+                    "adm1_pcode": [f"{iso_code}01" for iso_code in iso_codes],
+                },
+                geometry=[box(i * 10, 0, i * 10 + 5, 5) for i in range(len(iso_codes))],
+                crs="EPSG:4326",
+            )
+            return boundaries[columns + ["geometry"]]
+
+        return read_file
+
+    def test_regions(self, configuration, read_dataset, input_dir, monkeypatch):
+        monkeypatch.setattr(
+            "hdx.scraper.ecmwf.pipeline.read_file",
+            self.read_boundaries(["KEN", "BRA", "IND", "FRA", "NGA"]),
+        )
+        with temp_dir(
+            "TestECMWFRegions",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader=downloader,
+                    fallback_dir=tempdir,
+                    saved_dir=input_dir,
+                    temp_dir=tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                pipeline = Pipeline(configuration, retriever, tempdir)
+                pipeline.grib_data = [
+                    join(
+                        input_dir,
+                        "total_precipitation_anomalous_rate_of_accumulation_2025.grib",
+                    )
+                ]
+                pipeline.download_global_boundaries()
+                pipeline.process(datetime(2025, 3, 15))
+
+        regions = {
+            identifier: sorted(data["iso_code"].unique())
+            for identifier, data in pipeline.processed_data.items()
+            if identifier not in ("adm0", "adm1_global_3yrs")
+        }
+        assert regions == {
+            "adm1_africa": ["KEN", "NGA"],
+            "adm1_americas": ["BRA"],
+            "adm1_asia": ["IND"],
+            "adm1_europe": ["FRA"],
+        }
+        # 3 issue dates with 6 lead times each for every unit
+        assert len(pipeline.processed_data["adm1_africa"]) == 2 * 3 * 6
+        assert len(pipeline.processed_data["adm1_europe"]) == 3 * 6
+
+    def test_unmapped_region(self, configuration, read_dataset, input_dir, monkeypatch):
+        monkeypatch.setattr(
+            "hdx.scraper.ecmwf.pipeline.read_file",
+            self.read_boundaries(["KEN", "BRA", "XYZ", "IND"]),
+        )
+        with temp_dir("TestECMWFRegions") as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader=downloader,
+                    fallback_dir=tempdir,
+                    saved_dir=input_dir,
+                    temp_dir=tempdir,
+                    save=False,
+                    use_saved=True,
+                )
+                pipeline = Pipeline(configuration, retriever, tempdir)
+                with pytest.raises(KeyError, match="ISO3 codes: XYZ'$"):
+                    pipeline.download_global_boundaries()
+
+    def test_nothing_missing(self, configuration, input_dir, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError("nothing should be requested from CDS")
+
+        monkeypatch.setattr("hdx.scraper.ecmwf.pipeline.Client", fail)
+        monkeypatch.setattr("hdx.scraper.ecmwf.pipeline.ThreadPoolExecutor", fail)
+        with temp_dir("TestECMWFNothingMissing") as tempdir:
+            with Download(user_agent="test") as downloader:
+                retriever = Retrieve(
+                    downloader=downloader,
+                    fallback_dir=tempdir,
+                    saved_dir=input_dir,
+                    temp_dir=tempdir,
+                    save=False,
+                    use_saved=False,
+                )
+                configuration["min_year"] = 2024
+                pipeline = Pipeline(configuration, retriever, tempdir)
+                pipeline.existing_dates = [
+                    f"{year}-{month:02d}"
+                    for year in (2024, 2025)
+                    for month in range(1, 13)
+                ]
+                updated = pipeline.download_cds_data(
+                    cds_key="", today=datetime(2025, 3, 15), force_refresh=True
+                )
+                assert updated is False
+                assert pipeline.grib_data == []
+
+
+@pytest.fixture(scope="module")
+def features():
+    # overlapping boxes and triangles with fractional cell coverage, plus
+    # one polygon that misses the grid entirely
+    rng = np.random.default_rng(0)
+    geometries = []
+    for _ in range(40):
+        x, y = rng.uniform(-28, 25), rng.uniform(-18, 15)
+        width, height = rng.uniform(0.3, 6, 2)
+        geometries.append(box(x, y, x + width, y + height))
+        geometries.append(Polygon([(x, y), (x + width, y), (x, y + height)]))
+    geometries.append(box(100, 50, 101, 51))
+    boundaries = GeoDataFrame(geometry=geometries, crs="EPSG:4326")
+    return JSONFeatureSource(
+        list(boundaries.iterfeatures()), srs_wkt=boundaries.crs.to_wkt()
+    )
+
+
+class TestZonalStatistics:
+    @staticmethod
+    def make_grid(values: np.ndarray) -> xr.DataArray:
+        grid = xr.DataArray(
+            values,
+            coords={
+                "latitude": np.arange(19.5, -20, -1),
+                "longitude": np.arange(-29.5, 30),
+            },
+            dims=("latitude", "longitude"),
+        )
+        return grid.rio.write_crs("EPSG:4326")
+
+    @pytest.mark.parametrize("case", ["continuous", "ties", "missing", "all_missing"])
+    def test_matches_exactextract(self, features, case):
+        rng = np.random.default_rng(1)
+        values = rng.normal(0, 50, (40, 60)).astype(np.float32)
+        if case == "ties":
+            values = np.round(values / 40).astype(np.float32)
+        elif case == "missing":
+            values[rng.random(values.shape) < 0.3] = np.nan
+            values[5:15, 10:20] = np.nan
+        elif case == "all_missing":
+            values[:] = np.nan
+        grid = self.make_grid(values)
+
+        expected = exact_extract(
+            XArrayRasterSource(grid),
+            features,
+            ["count", "mean", "median"],
+            output="pandas",
+        )
+        cells, coverage, feature_ids = _get_coverage(xr.zeros_like(grid), features)
+        result = _zonal_statistics(values, cells, coverage, feature_ids, len(expected))
+        for stat in ("count", "mean", "median"):
+            np.testing.assert_array_equal(
+                result[stat], expected[stat].to_numpy(dtype=float)
+            )
+
+
+class TestRecentreLongitude:
+    @pytest.mark.parametrize(
+        "longitude",
+        [np.arange(0.5, 360, 45), np.array([10.0, 200.0, 100.0, 300.0])],
+        ids=["rollable", "unsorted"],
+    )
+    def test_recentre_longitude(self, longitude):
+        # each value is its own longitude, so it shows where each column went
+        dataset = xr.Dataset(
+            {"tp": (("latitude", "longitude"), np.tile(longitude, (2, 1)))},
+            coords={
+                "latitude": [0.5, -0.5],
+                "longitude": ("longitude", longitude, {"units": "degrees_east"}),
+            },
+        )
+        result = _recentre_longitude(dataset)
+
+        recentred = result.longitude.values
+        assert np.all(np.diff(recentred) > 0)
+        assert recentred.min() >= -180 and recentred.max() < 180
+        assert result.longitude.attrs == {"units": "degrees_east"}
+        np.testing.assert_array_equal(np.sort(recentred % 360), np.sort(longitude))
+        np.testing.assert_array_equal(
+            result["tp"].values, np.tile(recentred % 360, (2, 1))
+        )